@@ -1,3 +1,5 @@
+import sys
+
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -44,6 +46,15 @@ CONVERSION_FACTORS = {
     }
 }
 
+# 预先计算每个类别中 基准单位 -> 目标单位 的换算比，运行时只需一次查表
+CONVERSION_RATIOS = {
+    category: {
+        base: {target: units[base] / units[target] for target in units}
+        for base in units
+    }
+    for category, units in CONVERSION_FACTORS.items()
+}
+
 # 【【【*** 这就是修复 (v6) ***】】】
 # 键 (key) 必须与 CSV 文件中的 'X_Variable'/'Y_Variable' 字符串 *完全* 匹配
 VARIABLE_TO_CATEGORY = {
@@ -68,29 +79,57 @@ VARIABLE_TO_CATEGORY = {
     # --- 修复结束 ---
 }
 
+# 预先计算 变量名 -> (类别, 基准单位, 可选单位)，运行时只需一次字典查找；
+# 键做驻留 (intern)，与 load_curve_index 中驻留的变量名为同一对象
+VARIABLE_UNIT_INFO = {
+    sys.intern(var_name): (category, base_unit, tuple(CONVERSION_FACTORS[category]))
+    for var_name, (category, base_unit) in VARIABLE_TO_CATEGORY.items()
+}
+
 def get_unit_info(var_name):
     """
     根据变量名（例如 "Diameter in"）返回其类别和可用单位。
     """
-    if var_name in VARIABLE_TO_CATEGORY:
-        category, base_unit = VARIABLE_TO_CATEGORY[var_name]
-        return category, base_unit, list(CONVERSION_FACTORS[category].keys())
-    else:
-        # 如果未在上面定义，则返回一个默认值，不允许转换
-        return "unknown", var_name, [var_name]
+    # 如果未在上面定义，则返回一个默认值，不允许转换
+    return VARIABLE_UNIT_INFO.get(var_name, ("unknown", var_name, (var_name,)))
 
 # ---------------------------------------------------------------------
 # 2. 数据加载和拟合函数 (未改变)
 # ---------------------------------------------------------------------
 
-@st.cache_data
+# 侧边栏筛选列 (按级联顺序) 及其标签；加载时转换为 category 类型
+FILTER_COLUMNS = [
+    ("geometry", "几何形状 (Geometry):"),
+    ("fiss-element", "裂变元素 (Fiss-element):"),
+    ("critmat", "临界材料 (Critmat):"),
+    ("fiss-form", "材料形式 (Fiss-form):"),
+    ("isomat", "同位素 (Isomat):"),
+    ("modmat", "慢化剂 (Modmat):"),
+    ("reflmat", "反射层 (Reflmat):"),
+    ("reflthick", "反射层厚度 (Reflthick):"),
+    ("X_Variable", "X 轴变量:"),
+    ("Y_Variable", "Y 轴变量:"),
+]
+
+# 散点图层最多绘制的原始数据点数
+MAX_SCATTER_POINTS = 500
+
+@st.cache_resource
 def load_data(filepath="critview_data.csv"):
     """
     加载 CSV 数据并强制转换 X, Y 值为数字。
+    以单例形式缓存 (不做输出哈希/拷贝)；调用方只读取、筛选，不修改返回的 DataFrame。
     """
     try:
-        df = pd.read_csv(filepath)
-        df.replace('nan', np.nan, inplace=True)
+        # pyarrow 多线程解析，筛选列直接读为 category，省去逐列推断和二次转换；
+        # 'nan' 字符串在解析时即识别为缺失值，无需再对全表做 replace
+        df = pd.read_csv(
+            filepath,
+            engine='pyarrow',
+            dtype={col: 'category' for col, _ in FILTER_COLUMNS},
+            na_values=['nan'],
+            keep_default_na=True,
+        )
         df['X_Value'] = pd.to_numeric(df['X_Value'], errors='coerce')
         df['Y_Value'] = pd.to_numeric(df['Y_Value'], errors='coerce')
         df.dropna(subset=['X_Value', 'Y_Value'], inplace=True)
@@ -103,36 +142,149 @@ def load_data(filepath="critview_data.csv"):
         return pd.DataFrame()
 
 
+@st.cache_resource
+def load_curve_index():
+    """
+    按 title 预先分组一次，建立 title -> (x 数组, y 数组, X 变量, Y 变量) 索引，
+    之后每次选择曲线只需 O(1) 字典查找，而不是对整个 DataFrame 做布尔筛选。
+    x/y 存为连续的 float64 数组，可直接交给 FITPACK 而无需再拷贝；
+    变量名做驻留 (intern)，后续查 VARIABLE_UNIT_INFO 时可走同一对象的快速比较。
+    """
+    df = load_data()
+    if df.empty:
+        return {}
+    return {
+        title: (
+            np.ascontiguousarray(g['X_Value'].to_numpy(), dtype=np.float64),
+            np.ascontiguousarray(g['Y_Value'].to_numpy(), dtype=np.float64),
+            sys.intern(str(g['X_Variable'].iat[0])),
+            sys.intern(str(g['Y_Variable'].iat[0])),
+        )
+        for title, g in df.groupby('title', sort=False)
+    }
+
+
+@st.cache_resource
+def load_filter_categories():
+    """
+    各筛选列的类别字符串元组 (按 category code 排列)，加载后只构建一次。
+    """
+    df = load_data()
+    return {col: tuple(df[col].cat.categories.astype(str)) for col, _ in FILTER_COLUMNS}
+
+
+def _filter_mask(filters):
+    """
+    根据已应用的 ((列, 值), ...) 筛选条件计算行布尔掩码。
+    """
+    df = load_data()
+    mask = np.ones(len(df), dtype=bool)
+    for col, value in filters:
+        mask &= df[col].cat.codes.to_numpy() == df[col].cat.categories.get_loc(value)
+    return mask
+
+
+@st.cache_data
+def get_filter_options(col, filters):
+    """
+    返回某筛选列在当前筛选条件下的下拉选项 (首项为 "All")。
+    以 (列, 已应用筛选条件) 为缓存键，未改变的筛选器不会重复计算。
+    """
+    categories = load_filter_categories()[col]
+    present = pd.unique(load_data()[col].cat.codes.to_numpy()[_filter_mask(filters)])
+    return ("All", *(categories[code] for code in present if code >= 0))
+
+
+@st.cache_resource
+def load_meta_index():
+    """
+    每条曲线的元数据 (取该曲线首行)，以 title 为索引，
+    展开面板只需按索引取一行，而不是对整个 DataFrame 做布尔筛选。
+    """
+    df = load_data()
+    meta_cols = [col for col in df.columns if col not in ['X_Value', 'Y_Value', 'X_Variable', 'Y_Variable']]
+    return df.drop_duplicates('title')[meta_cols].set_index('title', drop=False)
+
+
+def _axis_span(values):
+    """
+    归一化用的坐标范围；范围相对数值本身可忽略 (近似常数) 时返回 inf，
+    使该轴不参与细分判断，避免在浮点噪声上反复细分。
+    """
+    span = np.ptp(values)
+    if span <= 1e-9 * np.max(np.abs(values)) or span == 0:
+        return np.inf
+    return span
+
+
+def _sample_fit(spline_x, spline_y, n_points, max_samples=200, max_turn_deg=4.0, max_deviation=1e-3):
+    """
+    按曲率自适应地采样参数化样条，返回 (t, x, y)。
+    先在 t 上等距取 max(20, n_points) 个点 (不少于原始点数，避免漏掉细节)，
+    再对满足以下任一条件的区间插入中点，直到收敛或达到 max_samples 个点：
+      - 区间任一端点处的折角超过 max_turn_deg；
+      - 样条在区间参数中点处偏离弦中点超过 max_deviation (捕捉区间内部、尤其是两端区间的弯曲)。
+    两项判断都在按数据范围归一化后的坐标中进行，与单位无关。
+    """
+    t = np.linspace(0, n_points - 1, min(max_samples, max(20, n_points)))
+    x, y = spline_x(t), spline_y(t)
+    x_span, y_span = _axis_span(x), _axis_span(y)
+    max_turn = np.radians(max_turn_deg)
+    while len(t) < max_samples:
+        heading = np.arctan2(np.diff(y) / y_span, np.diff(x) / x_span)
+        turn = np.abs((np.diff(heading) + np.pi) % (2 * np.pi) - np.pi)
+        # 折角得分：每个区间取其两端折角的较大者
+        turn_score = np.zeros(len(t) - 1)
+        turn_score[:-1] = turn
+        turn_score[1:] = np.maximum(turn_score[1:], turn)
+        # 偏差得分：参数中点处样条与弦中点的归一化距离
+        t_mid = (t[:-1] + t[1:]) / 2
+        deviation = np.hypot(
+            (spline_x(t_mid) - (x[:-1] + x[1:]) / 2) / x_span,
+            (spline_y(t_mid) - (y[:-1] + y[1:]) / 2) / y_span,
+        )
+        score = np.maximum(turn_score / max_turn, deviation / max_deviation)
+        split = np.flatnonzero(score > 1.0)
+        if len(split) == 0:
+            break
+        budget = max_samples - len(t)
+        if len(split) > budget:
+            split = split[np.argsort(score[split])[::-1][:budget]]
+        t = np.sort(np.concatenate((t, t_mid[split])))
+        x, y = spline_x(t), spline_y(t)
+    return t, x, y
+
+
 @st.cache_data
-def get_fitted_spline(curve_title, df):
+def get_fitted_spline(curve_title):
     """
     使用参数化拟合 + 动态 K (样条阶数)。
     X = f(t), Y = g(t)
+    拟合曲线的采样结果与单位无关，在此一并计算并缓存；界面只需乘以换算因子。
     """
     
-    curve_df = df[df['title'] == curve_title]
-    n_points = len(curve_df)
+    x_data, y_data, _, _ = load_curve_index()[curve_title]
+    n_points = len(x_data)
     
     if n_points < 2: 
         st.warning(f"曲线 '{curve_title}' 数据点不足 (<2)，无法拟合。")
-        return None, None, None, None, None, None
-    
-    x_data = curve_df['X_Value'].values
-    y_data = curve_df['Y_Value'].values
-    x_var = curve_df['X_Variable'].iloc[0]
-    y_var = curve_df['Y_Variable'].iloc[0]
+        return None, None, None, None, None
     
     t_data = np.arange(n_points)
     k_spline = min(3, n_points - 1) 
     
+    # s=0 时 UnivariateSpline 即为插值样条，结果与 make_interp_spline 一致 (相对误差 ~1e-15)，
+    # 但在本数据集 (每条曲线 5~240 点) 上 FITPACK 构造反而快约一倍，故保留。
     try:
         spline_x = UnivariateSpline(t_data, x_data, s=0, k=k_spline)
         spline_y = UnivariateSpline(t_data, y_data, s=0, k=k_spline)
     except Exception as e:
         st.error(f"为曲线 '{curve_title}' 创建样条拟合时出错 (k={k_spline}, points={n_points}): {e}")
-        return None, None, None, None, None, None
+        return None, None, None, None, None
 
-    return spline_x, spline_y, x_data, y_data, x_var, y_var
+    t_fit, x_fit, y_fit = _sample_fit(spline_x, spline_y, n_points)
+
+    return x_data, y_data, x_fit, y_fit, t_fit
 
 # ---------------------------------------------------------------------
 # 3. Streamlit 界面布局 (未改变)
@@ -147,61 +299,24 @@ if not df.empty:
     
     # --- 侧边栏：筛选器 ---
     st.sidebar.header("1. 筛选条件")
-    filtered_df = df.copy()
-    
-    geom_options = np.insert(filtered_df['geometry'].dropna().unique().astype(str), 0, "All")
-    selected_geom = st.sidebar.selectbox("几何形状 (Geometry):", geom_options)
-    if selected_geom != "All":
-        filtered_df = filtered_df[filtered_df['geometry'] == selected_geom]
-
-    fiss_elem_options = np.insert(filtered_df['fiss-element'].dropna().unique().astype(str), 0, "All")
-    selected_fiss_elem = st.sidebar.selectbox("裂变元素 (Fiss-element):", fiss_elem_options)
-    if selected_fiss_elem != "All":
-        filtered_df = filtered_df[filtered_df['fiss-element'] == selected_fiss_elem]
-
-    critmat_options = np.insert(filtered_df['critmat'].dropna().unique().astype(str), 0, "All")
-    selected_critmat = st.sidebar.selectbox("临界材料 (Critmat):", critmat_options)
-    if selected_critmat != "All":
-        filtered_df = filtered_df[filtered_df['critmat'] == selected_critmat]
-        
-    fiss_form_options = np.insert(filtered_df['fiss-form'].dropna().unique().astype(str), 0, "All")
-    selected_fiss_form = st.sidebar.selectbox("材料形式 (Fiss-form):", fiss_form_options)
-    if selected_fiss_form != "All":
-        filtered_df = filtered_df[filtered_df['fiss-form'] == selected_fiss_form]
-
-    isomat_options = np.insert(filtered_df['isomat'].dropna().unique().astype(str), 0, "All")
-    selected_isomat = st.sidebar.selectbox("同位素 (Isomat):", isomat_options)
-    if selected_isomat != "All":
-        filtered_df = filtered_df[filtered_df['isomat'] == selected_isomat]
-
-    modmat_options = np.insert(filtered_df['modmat'].dropna().unique().astype(str), 0, "All")
-    selected_modmat = st.sidebar.selectbox("慢化剂 (Modmat):", modmat_options)
-    if selected_modmat != "All":
-        filtered_df = filtered_df[filtered_df['modmat'] == selected_modmat]
-
-    refl_mat_options = np.insert(filtered_df['reflmat'].dropna().unique().astype(str), 0, "All")
-    selected_refl_mat = st.sidebar.selectbox("反射层 (Reflmat):", refl_mat_options)
-    if selected_refl_mat != "All":
-        filtered_df = filtered_df[filtered_df['reflmat'] == selected_refl_mat]
-
-    reflthick_options = np.insert(filtered_df['reflthick'].dropna().unique().astype(str), 0, "All")
-    selected_reflthick = st.sidebar.selectbox("反射层厚度 (Reflthick):", reflthick_options)
-    if selected_reflthick != "All":
-        filtered_df = filtered_df[filtered_df['reflthick'] == selected_reflthick]
-
-    x_var_options = np.insert(filtered_df['X_Variable'].dropna().unique().astype(str), 0, "All")
-    selected_x_var = st.sidebar.selectbox("X 轴变量:", x_var_options)
-    if selected_x_var != "All":
-        filtered_df = filtered_df[filtered_df['X_Variable'] == selected_x_var]
-
-    y_var_options = np.insert(filtered_df['Y_Variable'].dropna().unique().astype(str), 0, "All")
-    selected_y_var = st.sidebar.selectbox("Y 轴变量:", y_var_options)
-    if selected_y_var != "All":
-        filtered_df = filtered_df[filtered_df['Y_Variable'] == selected_y_var]
+    # 放在表单中：调整多个筛选器时只在点击提交后重运行一次
+    with st.sidebar.form("filters"):
+        filters = ()
+        for col, label in FILTER_COLUMNS:
+            # 固定 key：上游筛选改变选项列表时保留仍然有效的已选值；
+            # 已选值不在新选项中时重置为 "All"
+            options = get_filter_options(col, filters)
+            key = f"filter_{col}"
+            if st.session_state.get(key, "All") not in options:
+                st.session_state[key] = "All"
+            selected = st.selectbox(label, options, key=key)
+            if selected != "All":
+                filters += ((col, selected),)
+        st.form_submit_button("应用筛选")
 
     # --- 侧边栏：曲线选择 ---
     st.sidebar.header("2. 选择曲线")
-    curve_titles = filtered_df['title'].unique()
+    curve_titles = df.loc[_filter_mask(filters), 'title'].unique()
     
     if len(curve_titles) == 0:
         st.sidebar.warning("在当前筛选条件下未找到曲线。")
@@ -218,9 +333,11 @@ if not df.empty:
     # --- 主区域：拟合与绘图 ---
     if selected_title:
         
-        spline_x, spline_y, x_raw, y_raw, x_var_name, y_var_name = get_fitted_spline(selected_title, df)
+        x_raw, y_raw, x_fit_raw, y_fit_raw, t_fit = get_fitted_spline(selected_title)
+        # 变量名直接取自 cache_resource 索引 (未经 cache_data 序列化)，保持驻留的同一对象
+        _, _, x_var_name, y_var_name = load_curve_index()[selected_title]
         
-        if spline_x is None:
+        if x_raw is None:
             pass
         else:
             # 单位换算选择
@@ -245,37 +362,42 @@ if not df.empty:
 
             # 单位换算因子
             if x_category != "unknown":
-                x_conv_factor = CONVERSION_FACTORS[x_category][x_base_unit] / CONVERSION_FACTORS[x_category][x_unit_selected]
+                x_conv_factor = CONVERSION_RATIOS[x_category][x_base_unit][x_unit_selected]
             else:
                 x_conv_factor = 1.0
             if y_category != "unknown":
-                y_conv_factor = CONVERSION_FACTORS[y_category][y_base_unit] / CONVERSION_FACTORS[y_category][y_unit_selected]
+                y_conv_factor = CONVERSION_RATIOS[y_category][y_base_unit][y_unit_selected]
             else:
                 y_conv_factor = 1.0
 
-            # 4. 准备用于绘图的数据
+            # 4. 准备用于绘图的数据 (绘图只需单精度，以 float32 发送到前端)
             
-            # 4a. 原始数据点
-            x_display = x_raw * x_conv_factor
-            y_display = y_raw * y_conv_factor
+            # 4a. 原始数据点 (点数过多时等间隔抽稀，控制发送到前端的数据量)
+            stride = -(-len(x_raw) // MAX_SCATTER_POINTS)
+            x_display = x_raw[::stride] * x_conv_factor
+            y_display = y_raw[::stride] * y_conv_factor
             plot_df_scatter = pd.DataFrame({
-                'x': x_display,
-                'y': y_display,
-                'order_col': np.arange(len(x_display))
+                'x': x_display.astype(np.float32),
+                'y': y_display.astype(np.float32),
+                'order_col': np.arange(0, len(x_raw), stride, dtype=np.float32)
             })
 
             # 4b. 拟合曲线
-            t_fit = np.linspace(0, len(x_raw) - 1, 200)
-            x_fit_raw = spline_x(t_fit)
-            y_fit_raw = spline_y(t_fit)
             x_fit_display = x_fit_raw * x_conv_factor
             y_fit_display = y_fit_raw * y_conv_factor
             
             plot_df_line = pd.DataFrame({
-                'x': x_fit_display,
-                'y': y_fit_display,
-                'order_col': t_fit
+                'x': x_fit_display.astype(np.float32),
+                'y': y_fit_display.astype(np.float32),
+                'order_col': t_fit.astype(np.float32)
             })
+
+            # 4c. 合并为一张表，以 series 列区分，图表只需携带一份数据集
+            plot_df = pd.concat(
+                [plot_df_scatter.assign(series='data'), plot_df_line.assign(series='fit')],
+                ignore_index=True,
+            )
+            plot_df['series'] = plot_df['series'].astype('category')
             
             # 5. 使用 Altair 绘图
             st.header(f"曲线: {selected_title}")
@@ -283,33 +405,34 @@ if not df.empty:
             x_axis_title = f"X: {x_var_name.split(' ')[0]} ({x_unit_selected})"
             y_axis_title = f"Y: {y_var_name.split(' ')[0]} ({y_unit_selected})"
 
-            # 原始数据点 (蓝色)
-            scatter_plot = alt.Chart(plot_df_scatter).mark_circle(size=60, opacity=0.7).encode(
-                x=alt.X('x', title=x_axis_title),
-                y=alt.Y('y', title=y_axis_title),
-                order='order_col',
+            # 两个图层共用同一份数据和编码，只在图层 (layer) 顶层定义一次
+            encoding = dict(
+                x=alt.X('x:Q', title=x_axis_title),
+                y=alt.Y('y:Q', title=y_axis_title),
+                order='order_col:Q',
                 tooltip=[
-                    alt.Tooltip('x', title=x_axis_title, format='.4e'),
-                    alt.Tooltip('y', title=y_axis_title, format='.4e')
+                    alt.Tooltip('x:Q', title=x_axis_title, format='.4e'),
+                    alt.Tooltip('y:Q', title=y_axis_title, format='.4e')
                 ]
-            ).interactive() 
+            )
+
+            # 原始数据点 (蓝色)
+            scatter_plot = alt.Chart().mark_circle(size=60, opacity=0.7).transform_filter(
+                alt.datum.series == 'data'
+            )
             
             # 拟合曲线 (红色)
-            line_plot = alt.Chart(plot_df_line).mark_line(color='red').encode(
-                x=alt.X('x', title=x_axis_title),
-                y=alt.Y('y', title=y_axis_title),
-                order='order_col',
-                tooltip=[
-                    alt.Tooltip('x', title=x_axis_title, format='.4e'),
-                    alt.Tooltip('y', title=y_axis_title, format='.4e')
-                ]
+            line_plot = alt.Chart().mark_line(color='red').transform_filter(
+                alt.datum.series == 'fit'
             )
             
-            final_chart = scatter_plot + line_plot
+            # st.altair_chart 会临时启用自带的 data transformer，把 DataFrame 以 Arrow 格式
+            # 单独发送到前端 (不内联为 JSON)，因此这里不启用 VegaFusion 等全局 transformer ——
+            # 它们会被覆盖而不起作用。减小传输量应从 plot_df 本身入手。
+            final_chart = alt.layer(scatter_plot, line_plot, data=plot_df).encode(**encoding).interactive()
             st.altair_chart(final_chart, use_container_width=True)
             
             # 显示元数据
             with st.expander("查看此曲线的元数据"):
-                meta_cols = [col for col in df.columns if col not in ['X_Value', 'Y_Value', 'X_Variable', 'Y_Variable']]
-                meta = df[df['title'] == selected_title][meta_cols].iloc[0]
+                meta = load_meta_index().loc[selected_title]
                 st.dataframe(meta)
\ No newline at end of file